@@ -14,6 +14,7 @@ class Config:
     acnt_prdt_cd: str
     hts_id: str
     custtype: str = "P"
+    token_cache_path: str = ""  # 빈 값이면 토큰 디스크 캐시 사용 안 함
 
     @property
     def rest_base(self) -> str:
@@ -43,6 +44,7 @@ def load_config() -> Config:
         acnt_prdt_cd=os.getenv("KIS_ACNT_PRDT_CD", "01").strip(),
         hts_id=os.getenv("KIS_HTS_ID", "").strip(),
         custtype=os.getenv("KIS_CUSTTYPE", "P").strip() or "P",
+        token_cache_path=os.path.expanduser(os.getenv("KIS_TOKEN_CACHE", "~/.kis_token.json").strip()),
     )
 
     missing = [k for k, v in {
@@ -1,35 +1,132 @@
-import json
+import asyncio
+import hashlib
+import hmac
+import random
+import re
 import time
-from typing import Any, Dict, Optional
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Any, Dict, Optional, Tuple, Union
 
 import aiohttp
 
 from .config import Config
+from .json_utils import dumps, loads
+from .token_cache import load_token_cache, save_token_cache
+
+# 등락률 순위 조회 고정 파라미터 (fid_rsfl_rate1/2 만 호출마다 달라짐)
+_RANK_PARAMS_TEMPLATE = MappingProxyType({
+    "fid_cond_mrkt_div_code": "J",  # J: 주식
+    "fid_cond_scr_div_code": "20170",  # 등락률순위 화면
+    "fid_input_iscd": "0000",
+    "fid_rank_sort_cls_code": "0",  # 0: 상승률순
+    "fid_input_cnt_1": "0",
+    "fid_prc_cls_code": "0",
+    "fid_input_price_1": "",
+    "fid_input_price_2": "",
+    "fid_vol_cnt": "",
+    "fid_trgt_cls_code": "0",
+    "fid_trgt_exls_cls_code": "0",
+    "fid_div_cls_code": "0",
+})
+
+# 재시도 backoff (full jitter): sleep = uniform(0, min(cap, base * 2**attempt))
+_RETRY_BASE = 0.1
+_RETRY_CAP = 2.0
+
+_HASHKEY_CACHE_SIZE = 64
+
+# 주문 응답에서 ODNO만 바로 추출 (매치 실패 시에만 전체 JSON 파싱)
+_ODNO_RE = re.compile(rb'"(?:ODNO|odno)"\s*:\s*"([^"]+)"')
+
+
+class KISHTTPError(RuntimeError):
+    def __init__(self, status: int, body: str):
+        super().__init__(f"HTTP {status}: {body}")
+        self.status = status
+
+    @property
+    def retryable(self) -> bool:
+        return self.status == 429 or self.status >= 500
 
 
 class KISRest:
+    """
+    KIS REST 클라이언트. ClientSession(커넥션 풀)은 애플리케이션 수명 동안 하나만 유지한다:
+
+        async with KISRest(cfg) as rest:
+            while True:
+                await run_trading_session(cfg, rest, ...)
+
+    세션마다 KISRest를 새로 만들면 매번 TCP/TLS 핸드셰이크가 다시 발생한다.
+    """
+
     def __init__(self, cfg: Config):
         self.cfg = cfg
         self._access_token: Optional[str] = None
-        self._token_expire_at: float = 0.0
+        self._token_expire_at: float = 0.0  # time.monotonic() 기준
+        self._token_expire_wall: float = 0.0  # time.time() 기준, 디스크 캐시 저장용
         self._approval_key: Optional[str] = None
+        # time.time() 기준 발급 시각. 08:30 강제 재발급을 재시작 시 생략할지 판단하는 데 사용
+        self._token_issued_wall: float = 0.0
+        self._approval_issued_wall: float = 0.0
+        self._hdr_cache: Dict[Tuple[str, str], Dict[str, str]] = {}
+        self._rank_params: Dict[Tuple[int, int], Dict[str, str]] = {}
+        # 로컬 hashkey 계산 검증 결과: None=미검증, True=로컬 사용, False=항상 /uapi/hashkey 호출
+        self._hashkey_local_ok: Optional[bool] = None
+        # 원격 hashkey 결과 LRU (직렬화된 body bytes -> HASH), 토큰 강제 재발급 시 초기화
+        self._hashkey_cache_enabled = True
+        self._hashkey_cache: "OrderedDict[bytes, str]" = OrderedDict()
         self._session: Optional[aiohttp.ClientSession] = None
+        # 동시 호출 시 토큰/approval_key 중복 발급 방지
+        self._token_lock = asyncio.Lock()
+        self._approval_lock = asyncio.Lock()
+        # 주문 본문 JSON 중 계좌 관련 고정부분 (dumps(dict)와 같은 compact 형식)
+        self._order_body_prefix: bytes = (
+            b'{"CANO":' + dumps(cfg.cano) + b',"ACNT_PRDT_CD":' + dumps(cfg.acnt_prdt_cd) + b","
+        )
+        self._load_cached_tokens()
 
     async def __aenter__(self):
-        timeout = aiohttp.ClientTimeout(total=10)
-        self._session = aiohttp.ClientSession(timeout=timeout)
+        self._session = self._new_session()
         return self
 
     async def __aexit__(self, exc_type, exc, tb):
         if self._session:
             await self._session.close()
 
+    def _new_session(self) -> aiohttp.ClientSession:
+        # 모든 요청이 단일 KIS 호스트로 가므로 keep-alive 커넥션을 재사용하도록 풀을 잡아둔다
+        connector = aiohttp.TCPConnector(
+            limit=20,
+            limit_per_host=8,
+            keepalive_timeout=75,
+            ttl_dns_cache=300,
+            enable_cleanup_closed=True,
+        )
+        timeout = aiohttp.ClientTimeout(total=10, sock_connect=3, sock_read=5)
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            headers={"Connection": "keep-alive"},
+        )
+
+    async def recreate_session(self):
+        """커넥션 풀이 깨졌을 때 KISRest(토큰/캐시)는 유지한 채 ClientSession만 새로 만든다."""
+        old = self._session
+        self._session = self._new_session()
+        if old and not old.closed:
+            await old.close()
+
     @property
     def session(self) -> aiohttp.ClientSession:
-        assert self._session is not None
+        assert self._session is not None and not self._session.closed, (
+            "KISRest session이 열려있지 않음: `async with KISRest(cfg) as rest:` 블록 안에서 "
+            "여러 세션에 걸쳐 재사용하거나, 닫힌 경우 rest.recreate_session()을 호출할 것"
+        )
         return self._session
 
-    async def _request(
+    async def _request_bytes(
         self,
         method: str,
         path: str,
@@ -37,120 +134,226 @@ class KISRest:
         headers: Optional[Dict[str, str]] = None,
         params: Optional[Dict[str, str]] = None,
         json_body: Optional[Dict[str, Any]] = None,
-        data: Optional[str] = None,
+        data: Optional[Union[str, bytes]] = None,
         retry: int = 2,
-    ) -> Dict[str, Any]:
+    ) -> bytes:
         url = self.cfg.rest_base + path
+        if json_body is not None:
+            # aiohttp의 json= 는 표준 json을 쓰므로 미리 직렬화해서 data로 전달
+            data = dumps(json_body)
         last_err = None
-        for _ in range(retry + 1):
+        for attempt in range(retry + 1):
             try:
                 async with self.session.request(
                     method,
                     url,
                     headers=headers,
                     params=params,
-                    json=json_body,
                     data=data,
                 ) as resp:
-                    txt = await resp.text()
+                    raw = await resp.read()
                     if resp.status >= 400:
-                        raise RuntimeError(f"HTTP {resp.status}: {txt}")
-                    if not txt:
-                        return {}
-                    return json.loads(txt)
-            except Exception as e:
+                        raise KISHTTPError(resp.status, raw.decode("utf-8", "replace"))
+                    return raw
+            except KISHTTPError as e:
+                # 4xx(429 제외)는 재시도해도 결과가 같으므로 바로 실패 처리
+                if not e.retryable:
+                    raise RuntimeError(f"REST 요청 실패: {method} {path}: {e}") from e
                 last_err = e
-                await aiohttp.helpers.asyncio.sleep(0.2)  # type: ignore
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_err = e
+            if attempt < retry:
+                await asyncio.sleep(random.uniform(0, min(_RETRY_CAP, _RETRY_BASE * (2 ** attempt))))
         raise RuntimeError(f"REST 요청 실패: {method} {path}: {last_err}")
 
+    async def _request(self, method: str, path: str, **kwargs: Any) -> Dict[str, Any]:
+        raw = await self._request_bytes(method, path, **kwargs)
+        if not raw:
+            return {}
+        return loads(raw)
+
+    def _load_cached_tokens(self):
+        # 재시작 시 디스크에 남은 토큰이 유효하면 재발급 없이 그대로 사용
+        c = load_token_cache(self.cfg.token_cache_path)
+        if not c or c.get("env") != self.cfg.env or c.get("app_key") != self.cfg.app_key:
+            return
+        token = c.get("token")
+        exp = float(c.get("exp") or 0.0)
+        remain = exp - time.time()
+        if not token or remain <= 60:
+            return
+        self._access_token = token
+        self._token_expire_at = time.monotonic() + remain
+        self._token_expire_wall = exp
+        self._token_issued_wall = float(c.get("issued") or 0.0)
+        self._approval_key = c.get("approval") or None
+        if self._approval_key:
+            self._approval_issued_wall = float(c.get("approval_issued") or 0.0)
+
+    def _save_cached_tokens(self):
+        try:
+            save_token_cache(self.cfg.token_cache_path, {
+                "env": self.cfg.env,
+                "app_key": self.cfg.app_key,
+                "token": self._access_token,
+                "exp": self._token_expire_wall,
+                "issued": self._token_issued_wall,
+                "approval": self._approval_key,
+                "approval_issued": self._approval_issued_wall,
+            })
+        except OSError:
+            pass
+
     async def force_refresh_tokens(self):
         self._access_token = None
         self._token_expire_at = 0.0
+        self._token_expire_wall = 0.0
+        self._token_issued_wall = 0.0
         self._approval_key = None
-        await self.get_access_token()
-        await self.get_approval_key()
+        self._approval_issued_wall = 0.0
+        self._hdr_cache.clear()
+        self._hashkey_cache.clear()
+        await asyncio.gather(self.get_access_token(), self.get_approval_key())
 
-    async def get_access_token(self) -> str:
-        now = time.time()
-        if self._access_token and now < self._token_expire_at - 30:
+    def tokens_issued_since(self, wall_ts: float) -> bool:
+        """access_token/approval_key 가 모두 유효하고 wall_ts(time.time() 기준) 이후 발급됐으면 True."""
+        return (
+            self._token_fast() is not None
+            and self._approval_key is not None
+            and self._token_issued_wall >= wall_ts
+            and self._approval_issued_wall >= wall_ts
+        )
+
+    def _token_fast(self) -> Optional[str]:
+        # 토큰이 유효하면 코루틴 생성 없이 바로 반환 (get_access_token 과 같은 30초 여유)
+        if self._access_token and time.monotonic() < self._token_expire_at - 30:
             return self._access_token
+        return None
 
-        body = {
-            "grant_type": "client_credentials",
-            "appkey": self.cfg.app_key,
-            "appsecret": self.cfg.app_secret,
-        }
-        headers = {"content-type": "application/json"}
-        res = await self._request("POST", "/oauth2/tokenP", headers=headers, json_body=body)
+    async def get_access_token(self) -> str:
+        token = self._token_fast()
+        if token:
+            return token
 
-        token = res.get("access_token")
-        expires_in = int(res.get("expires_in", 0)) or 0
-        if not token:
-            raise RuntimeError(f"토큰 발급 실패: {res}")
+        async with self._token_lock:
+            # 락 대기 중 다른 호출이 이미 발급했으면 그대로 사용
+            token = self._token_fast()
+            if token:
+                return token
 
-        self._access_token = token
-        self._token_expire_at = time.time() + max(60, expires_in)
-        return token
+            body = {
+                "grant_type": "client_credentials",
+                "appkey": self.cfg.app_key,
+                "appsecret": self.cfg.app_secret,
+            }
+            headers = {"content-type": "application/json"}
+            res = await self._request("POST", "/oauth2/tokenP", headers=headers, json_body=body)
+
+            token = res.get("access_token")
+            expires_in = int(res.get("expires_in", 0)) or 0
+            if not token:
+                raise RuntimeError(f"토큰 발급 실패: {res}")
+
+            self._access_token = token
+            self._token_expire_at = time.monotonic() + max(60, expires_in)
+            self._token_issued_wall = time.time()
+            self._token_expire_wall = self._token_issued_wall + max(60, expires_in)
+            self._hdr_cache.clear()
+            self._save_cached_tokens()
+            return token
+
+    def _make_headers(self, tr_id: str, token: str) -> Dict[str, str]:
+        # (tr_id, token)별로 동일한 헤더 dict 재사용. 호출측에서 수정하지 말 것(필요하면 복사).
+        key = (tr_id, token)
+        hdr = self._hdr_cache.get(key)
+        if hdr is None:
+            hdr = {
+                "content-type": "application/json; charset=utf-8",
+                "authorization": f"Bearer {token}",
+                "appKey": self.cfg.app_key,
+                "appSecret": self.cfg.app_secret,
+                "tr_id": tr_id,
+                "custtype": self.cfg.custtype,
+            }
+            self._hdr_cache[key] = hdr
+        return hdr
 
     async def get_approval_key(self) -> str:
         if self._approval_key:
             return self._approval_key
 
-        body = {
-            "grant_type": "client_credentials",
-            "appkey": self.cfg.app_key,
-            "secretkey": self.cfg.app_secret,
-            "appsecret": self.cfg.app_secret,
-        }
-        headers = {"content-type": "application/json"}
-        res = await self._request("POST", "/oauth2/Approval", headers=headers, json_body=body)
+        async with self._approval_lock:
+            if self._approval_key:
+                return self._approval_key
+
+            body = {
+                "grant_type": "client_credentials",
+                "appkey": self.cfg.app_key,
+                "secretkey": self.cfg.app_secret,
+                "appsecret": self.cfg.app_secret,
+            }
+            headers = {"content-type": "application/json"}
+            res = await self._request("POST", "/oauth2/Approval", headers=headers, json_body=body)
+
+            key = res.get("approval_key")
+            if not key:
+                raise RuntimeError(f"approval_key 발급 실패: {res}")
 
-        key = res.get("approval_key")
-        if not key:
-            raise RuntimeError(f"approval_key 발급 실패: {res}")
+            self._approval_key = key
+            self._approval_issued_wall = time.time()
+            self._save_cached_tokens()
+            return key
 
-        self._approval_key = key
-        return key
+    def _local_hashkey(self, body: bytes) -> str:
+        return hmac.new(self.cfg.app_secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
 
     async def hashkey(self, data_obj: Dict[str, Any]) -> str:
+        return await self._hashkey_bytes(dumps(data_obj))
+
+    async def _hashkey_bytes(self, body: bytes) -> str:
+        # body: 실제 전송할 직렬화된 JSON bytes (주문 본문과 바이트 단위로 같아야 함)
+        if self._hashkey_local_ok:
+            return self._local_hashkey(body)
+        if self._hashkey_cache_enabled:
+            cached = self._hashkey_cache.get(body)
+            if cached is not None:
+                self._hashkey_cache.move_to_end(body)
+                return cached
+
         headers = {
             "content-type": "application/json",
             "appKey": self.cfg.app_key,
             "appSecret": self.cfg.app_secret,
         }
-        res = await self._request("POST", "/uapi/hashkey", headers=headers, json_body=data_obj)
+        res = await self._request("POST", "/uapi/hashkey", headers=headers, data=body)
         h = res.get("HASH")
         if not h:
             raise RuntimeError(f"hashkey 실패: {res}")
+
+        # 첫 응답으로 로컬 HMAC-SHA256 결과를 1회 검증. 일치할 때만 이후 네트워크 호출 생략
+        if self._hashkey_local_ok is None:
+            self._hashkey_local_ok = hmac.compare_digest(self._local_hashkey(body), h)
+        if self._hashkey_cache_enabled:
+            self._hashkey_cache[body] = h
+            if len(self._hashkey_cache) > _HASHKEY_CACHE_SIZE:
+                self._hashkey_cache.popitem(last=False)
         return h
 
     async def get_ranking_fluctuation(self, min_rate: int = 20, max_rate: int = 28) -> Dict[str, Any]:
-        token = await self.get_access_token()
-        headers = {
-            "content-type": "application/json; charset=utf-8",
-            "authorization": f"Bearer {token}",
-            "appKey": self.cfg.app_key,
-            "appSecret": self.cfg.app_secret,
-            "tr_id": "FHPST01700000",
-            "custtype": self.cfg.custtype,
-        }
-        params = {
-            "fid_cond_mrkt_div_code": "J",  # J: 주식
-            "fid_cond_scr_div_code": "20170",  # 등락률순위 화면
-            "fid_input_iscd": "0000",
-            "fid_rank_sort_cls_code": "0",  # 0: 상승률순
-            "fid_input_cnt_1": "0",
-            "fid_prc_cls_code": "0",
-            "fid_input_price_1": "",
-            "fid_input_price_2": "",
-            "fid_vol_cnt": "",
-            "fid_trgt_cls_code": "0",
-            "fid_trgt_exls_cls_code": "0",
-            "fid_div_cls_code": "0",
-            "fid_rsfl_rate1": "",
-            "fid_rsfl_rate2": "",
-        }
-        return await self._request(
+        raw = await self.get_ranking_fluctuation_raw(min_rate, max_rate)
+        if not raw:
+            return {}
+        return loads(raw)
+
+    async def get_ranking_fluctuation_raw(self, min_rate: int = 20, max_rate: int = 28) -> bytes:
+        # 스캔 루프용: 응답을 파싱하지 않고 원본 bytes 그대로 반환
+        token = self._token_fast() or await self.get_access_token()
+        headers = self._make_headers("FHPST01700000", token)
+        params = self._rank_params.get((min_rate, max_rate))
+        if params is None:
+            params = {**_RANK_PARAMS_TEMPLATE, "fid_rsfl_rate1": str(min_rate), "fid_rsfl_rate2": str(max_rate)}
+            self._rank_params[(min_rate, max_rate)] = params
+        return await self._request_bytes(
             "GET",
             "/uapi/domestic-stock/v1/ranking/fluctuation",
             headers=headers,
@@ -158,16 +361,9 @@ class KISRest:
         )
 
     async def inquire_psbl_cash(self, pdno: str, ord_unpr: int, ord_dvsn: str = "00") -> int:
-        token = await self.get_access_token()
+        token = self._token_fast() or await self.get_access_token()
         tr_id = "VTTC8908R" if self.cfg.env == "vts" else "TTTC8908R"
-        headers = {
-            "content-type": "application/json; charset=utf-8",
-            "authorization": f"Bearer {token}",
-            "appKey": self.cfg.app_key,
-            "appSecret": self.cfg.app_secret,
-            "tr_id": tr_id,
-            "custtype": self.cfg.custtype,
-        }
+        headers = self._make_headers(tr_id, token)
         params = {
             "CANO": self.cfg.cano,
             "ACNT_PRDT_CD": self.cfg.acnt_prdt_cd,
@@ -190,43 +386,36 @@ class KISRest:
         raise RuntimeError(f"매수가능금액 파싱 실패: {res}")
 
     async def order_cash(self, side: str, pdno: str, qty: int, unpr: int, ord_dvsn: str) -> str:
-        token = await self.get_access_token()
+        token = self._token_fast() or await self.get_access_token()
 
         if self.cfg.env == "vts":
             candidates = [("VTTC0012U", "VTTC0011U"), ("VTTC0802U", "VTTC0801U")]
         else:
             candidates = [("TTTC0012U", "TTTC0011U"), ("TTTC0802U", "TTTC0801U")]
 
-        body = {
-            "CANO": self.cfg.cano,
-            "ACNT_PRDT_CD": self.cfg.acnt_prdt_cd,
-            "PDNO": pdno,
-            "ORD_DVSN": ord_dvsn,
-            "ORD_QTY": str(int(qty)),
-            "ORD_UNPR": str(int(unpr)),
-        }
+        # pdno/ord_dvsn 은 영숫자 코드이므로 escape 없이 그대로 삽입
+        body = b'%b"PDNO":"%b","ORD_DVSN":"%b","ORD_QTY":"%d","ORD_UNPR":"%d"}' % (
+            self._order_body_prefix, pdno.encode("ascii"), ord_dvsn.encode("ascii"), int(qty), int(unpr)
+        )
 
-        hk = await self.hashkey(body)
+        hk = await self._hashkey_bytes(body)
 
         last_err = None
         for buy_tr, sell_tr in candidates:
             tr_id = buy_tr if side == "buy" else sell_tr
-            headers = {
-                "content-type": "application/json; charset=utf-8",
-                "authorization": f"Bearer {token}",
-                "appKey": self.cfg.app_key,
-                "appSecret": self.cfg.app_secret,
-                "tr_id": tr_id,
-                "custtype": self.cfg.custtype,
-                "hashkey": hk,
-            }
+            headers = dict(self._make_headers(tr_id, token))
+            headers["hashkey"] = hk
             try:
-                res = await self._request(
+                raw = await self._request_bytes(
                     "POST",
                     "/uapi/domestic-stock/v1/trading/order-cash",
                     headers=headers,
-                    json_body=body,
+                    data=body,
                 )
+                m = _ODNO_RE.search(raw)
+                if m:
+                    return m.group(1).decode("ascii", "replace")
+                res = loads(raw) if raw else {}
                 out = res.get("output") or {}
                 odno = out.get("ODNO") or out.get("odno")
                 if not odno:
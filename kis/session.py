@@ -1,3 +1,4 @@
+import time
 import traceback
 from datetime import datetime
 from typing import Dict, Optional, Tuple
@@ -6,13 +7,13 @@ from .config import Config
 from .rest import KISRest
 from .ws import KISWebSocket
 from .strategy import find_candidate, ioc_buy_with_ws, wait_for_1pct_then_sell, ioc_sell_with_ws
-from .time_utils import is_weekend, kst_now
+from .time_utils import is_weekend, monotonic_deadline
 
 
 async def run_trading_session(
     cfg: Config,
     rest: KISRest,
-    cooldowns: Dict[str, datetime],
+    cooldowns: Dict[str, float],
     logger,
     *,
     session_start: datetime,
@@ -30,44 +31,56 @@ async def run_trading_session(
     await ws.connect()
 
     open_position: Optional[Tuple[str, int, float]] = None  # (code, qty, avg_buy)
+    session_end_mono = monotonic_deadline(session_end)
 
     try:
         done = 0
-        while done < 5 and kst_now() < session_end:
+        while done < 5 and time.monotonic() < session_end_mono:
             code = await find_candidate(rest, cooldowns, logger, session_end=session_end)
             if not code:
                 logger.info("No candidate until session end.")
                 break
 
-            buy_qty, avg_buy = await ioc_buy_with_ws(rest, ws, code, logger, session_end=session_end)
-            cooldowns[code] = kst_now()
-
-            if buy_qty <= 0:
-                logger.warning("BUY failed. back to scanning...")
-                continue
-
-            open_position = (code, buy_qty, avg_buy)
+            # 매수 -> 목표가 대기 -> 매도 동안 호가/체결가 구독을 한 번만 유지
+            approval_key = await rest.get_approval_key()
+            await ws.subscribe("H0STASP0", code, approval_key=approval_key)
+            await ws.subscribe("H0STCNT0", code, approval_key=approval_key)
+            try:
+                buy_qty, avg_buy = await ioc_buy_with_ws(
+                    rest, ws, code, logger, session_end=session_end, already_subscribed=True
+                )
+                cooldowns[code] = time.monotonic()
 
-            sold_qty, sold_value, target_hit = await wait_for_1pct_then_sell(
-                rest, ws, code, buy_qty, avg_buy, logger, session_end=session_end
-            )
-            cooldowns[code] = kst_now()
+                if buy_qty <= 0:
+                    logger.warning("BUY failed. back to scanning...")
+                    continue
 
-            if sold_qty <= 0:
-                logger.warning("SELL failed or not filled. (code=%s qty=%s)", code, buy_qty)
                 open_position = (code, buy_qty, avg_buy)
-            else:
-                avg_sell = sold_value / sold_qty
-                pnl_pct = (avg_sell / avg_buy - 1.0) * 100.0
-                logger.info(
-                    "TRADE DONE code=%s qty=%s avg_buy=%.2f avg_sell=%.2f pnl=%.3f%% target_hit=%s",
-                    code, sold_qty, avg_buy, avg_sell, pnl_pct, target_hit
+
+                sold_qty, sold_value, target_hit = await wait_for_1pct_then_sell(
+                    rest, ws, code, buy_qty, avg_buy, logger, session_end=session_end, already_subscribed=True
                 )
-                open_position = None
-                done += 1
-                logger.info("Progress: %s/5", done)
+                cooldowns[code] = time.monotonic()
+
+                if sold_qty <= 0:
+                    logger.warning("SELL failed or not filled. (code=%s qty=%s)", code, buy_qty)
+                    open_position = (code, buy_qty, avg_buy)
+                else:
+                    avg_sell = sold_value / sold_qty
+                    pnl_pct = (avg_sell / avg_buy - 1.0) * 100.0
+                    logger.info(
+                        "TRADE DONE code=%s qty=%s avg_buy=%.2f avg_sell=%.2f pnl=%.3f%% target_hit=%s",
+                        code, sold_qty, avg_buy, avg_sell, pnl_pct, target_hit
+                    )
+                    open_position = None
+                    done += 1
+                    logger.info("Progress: %s/5", done)
+            finally:
+                await ws.unsubscribe("H0STASP0", code, approval_key=approval_key)
+                await ws.unsubscribe("H0STCNT0", code, approval_key=approval_key)
+                ws.clear_order_queues()
 
-        if open_position and kst_now() >= session_end:
+        if open_position and time.monotonic() >= session_end_mono:
             code, qty, avg_buy = open_position
             logger.warning("Session end. Force liquidation attempt: %s qty=%s", code, qty)
             sold_qty, sold_value = await ioc_sell_with_ws(rest, ws, code, qty, logger, session_end=session_end)
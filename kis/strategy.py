@@ -1,62 +1,101 @@
 import asyncio
+import logging
 import math
+import time
 import traceback
-from datetime import datetime, timedelta
-from typing import Dict, Optional, Tuple
+from datetime import datetime
+from typing import Dict, Iterator, Optional, Tuple
 
+from .json_utils import loads
 from .rest import KISRest
 from .ws import KISWebSocket
-from .time_utils import kst_now
-
-
-def pick_code_from_ranking_item(item: dict, logger) -> Optional[str]:
-    code = (item.get("stck_shrn_iscd") or item.get("mksc_shrn_iscd") or item.get("code") or "").strip()
-    rate = item.get("prdy_ctrt") or item.get("prdy_ctrt_1") or item.get("fluc_rt") or item.get("rate")
+from .time_utils import monotonic_deadline
+
+
+def _ranking_item_row(item: dict, logger) -> Optional[Tuple[str, float]]:
+    # FHPST01700000 응답은 stck_shrn_iscd / prdy_ctrt(문자열)를 준다. 그 외 키는 느린 경로에서만 확인
+    code = item.get("stck_shrn_iscd")
+    rate = item.get("prdy_ctrt")
+    if not code or rate is None:
+        code = (code or item.get("mksc_shrn_iscd") or item.get("code") or "").strip()
+        if rate is None:
+            rate = item.get("prdy_ctrt_1") or item.get("fluc_rt") or item.get("rate")
+        if not code or rate is None:
+            return None
     try:
-        rate_f = float(str(rate))
-    except Exception:
+        return code, float(rate)
+    except (TypeError, ValueError):
         logger.warning("conversion float error when pick code from ranking item")
-    if 20.0 <= rate_f <= 28.0 and code:
-        return code
-    return None
+        return None
+
+
+# 같은 종목 재진입 금지 시간(초)
+_COOLDOWN_SEC = 20 * 60.0
+
+# 적응형 폴링: 후보가 없으면 간격을 2배씩(최대 3초) 늘리고, 쿨다운이 아닌 임계 근처 종목이 보이면 다시 초당 3회
+_POLL_MIN = 1.0 / 3.0
+_POLL_MAX = 3.0
+_NEAR_RATE = 18.0
+
+# 매수 후보 등락률 구간(%). 스캔 조회는 근접 종목까지 보이도록 _NEAR_RATE부터 요청
+_PICK_MIN_RATE = 20.0
+_PICK_MAX_RATE = 28.0
+
+
+def iter_ranking_rows(raw: bytes, logger) -> Iterator[Tuple[str, float]]:
+    """등락률 순위 응답(raw bytes)에서 (종목코드, 등락률)을 순위 순서대로 반환."""
+    res = loads(raw) if raw else {}
+    items = []
+    for k in ("output", "output1", "Output", "Output1"):
+        v = res.get(k)
+        if isinstance(v, list):
+            items = v
+            break
+
+    for it in items:
+        if not isinstance(it, dict):
+            continue
+        row = _ranking_item_row(it, logger)
+        if row:
+            yield row
 
 
 async def find_candidate(
     rest: KISRest,
-    cooldowns: Dict[str, datetime],
+    cooldowns: Dict[str, float],
     logger,
     *,
     session_end: datetime,
 ) -> Optional[str]:
-    poll_interval = 1.0 / 3.0  # 초당 3회
+    """cooldowns: 종목코드 -> 마지막 거래 시각(time.monotonic())"""
+    poll_interval = _POLL_MIN  # 기본 초당 3회
     try_cnt = 0
-    while kst_now() < session_end:
-        res = await rest.get_ranking_fluctuation(20, 28)
+    session_end_mono = monotonic_deadline(session_end)
+    while time.monotonic() < session_end_mono:
+        raw = await rest.get_ranking_fluctuation_raw(int(_NEAR_RATE), int(_PICK_MAX_RATE))
         if try_cnt < 10:
-            print(res)
-        try_cnt += 1
-        items = []
-        for k in ("output", "output1", "Output", "Output1"):
-            v = res.get(k)
-            if isinstance(v, list):
-                items = v
-                break
-
-        now = kst_now()
-        for it in items:
-            if not isinstance(it, dict):
-                continue
-            code = pick_code_from_ranking_item(it, logger)
-            if not code:
-                continue
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("ranking sample: %s", raw.decode("utf-8", "replace"))
+            try_cnt += 1
 
+        now_mono = time.monotonic()
+        near = False
+        for code, rate_f in iter_ranking_rows(raw, logger):
             last = cooldowns.get(code)
-            if last and (now - last) < timedelta(minutes=20):
+            if last is not None and now_mono - last < _COOLDOWN_SEC:
+                continue
+            if rate_f >= _NEAR_RATE:
+                near = True
+            if not (_PICK_MIN_RATE <= rate_f <= _PICK_MAX_RATE):
                 continue
 
             logger.info("Candidate picked: %s", code)
             return code
 
+        if near:
+            poll_interval = _POLL_MIN
+        else:
+            poll_interval = min(_POLL_MAX, poll_interval * 2)
         await asyncio.sleep(poll_interval)
 
     return None
@@ -71,21 +110,25 @@ async def ioc_buy_with_ws(
     session_end: datetime,
     max_attempts: int = 20,
     cash_use_ratio: float = 0.98,
+    already_subscribed: bool = False,
 ) -> Tuple[int, float]:
     """
     요구사항 반영:
     - (WS) 호가 1회 수신 -> IOC 1회 주문 -> 다음 호가(WS) -> 다음 주문 반복
+    - already_subscribed=True 면 호출측이 H0STASP0 구독/해제를 관리
     """
     approval_key = await rest.get_approval_key()
-    await ws.subscribe("H0STASP0", code, approval_key=approval_key)
+    if not already_subscribed:
+        await ws.subscribe("H0STASP0", code, approval_key=approval_key)
 
     total_qty = 0
     total_value = 0
     last_seq = ws._orderbook_seq.get(code, 0)
+    session_end_mono = monotonic_deadline(session_end)
 
     try:
         for attempt in range(1, max_attempts + 1):
-            if kst_now() >= session_end:
+            if time.monotonic() >= session_end_mono:
                 break
 
             seq, ask1, askq1, bid1, bidq1 = await ws.wait_next_orderbook(code, last_seq, timeout=5.0)
@@ -117,7 +160,8 @@ async def ioc_buy_with_ws(
         print(traceback.format_exc())
 
     finally:
-        await ws.unsubscribe("H0STASP0", code, approval_key=approval_key)
+        if not already_subscribed:
+            await ws.unsubscribe("H0STASP0", code, approval_key=approval_key)
 
     if total_qty <= 0:
         return 0, 0.0
@@ -133,9 +177,11 @@ async def ioc_sell_with_ws(
     *,
     session_end: datetime,
     max_attempts: int = 30,
+    already_subscribed: bool = False,
 ) -> Tuple[int, int]:
     approval_key = await rest.get_approval_key()
-    await ws.subscribe("H0STASP0", code, approval_key=approval_key)
+    if not already_subscribed:
+        await ws.subscribe("H0STASP0", code, approval_key=approval_key)
 
     remain = int(qty_to_sell)
     sold_qty = 0
@@ -170,7 +216,8 @@ async def ioc_sell_with_ws(
         print(traceback.format_exc())
 
     finally:
-        await ws.unsubscribe("H0STASP0", code, approval_key=approval_key)
+        if not already_subscribed:
+            await ws.unsubscribe("H0STASP0", code, approval_key=approval_key)
 
     return sold_qty, sold_value
 
@@ -184,12 +231,15 @@ async def wait_for_1pct_then_sell(
     logger,
     *,
     session_end: datetime,
+    already_subscribed: bool = False,
 ) -> Tuple[int, int, bool]:
     """
     - 1% 목표가까지 기다리되, 15:00(session_end)까지 못 찍으면 종료 시점에 강제 매도 시도
+    - already_subscribed=True 면 호출측이 H0STCNT0/H0STASP0 구독/해제를 관리
     """
     approval_key = await rest.get_approval_key()
-    await ws.subscribe("H0STCNT0", code, approval_key=approval_key)
+    if not already_subscribed:
+        await ws.subscribe("H0STCNT0", code, approval_key=approval_key)
 
     target = math.ceil(avg_buy * 1.01)
     logger.info("Target(+1%%)=%s (avg_buy=%.2f)", target, avg_buy)
@@ -205,7 +255,10 @@ async def wait_for_1pct_then_sell(
     except Exception:
         print(traceback.format_exc())
     finally:
-        await ws.unsubscribe("H0STCNT0", code, approval_key=approval_key)
+        if not already_subscribed:
+            await ws.unsubscribe("H0STCNT0", code, approval_key=approval_key)
 
-    sold_qty, sold_value = await ioc_sell_with_ws(rest, ws, code, buy_qty, logger, session_end=session_end)
+    sold_qty, sold_value = await ioc_sell_with_ws(
+        rest, ws, code, buy_qty, logger, session_end=session_end, already_subscribed=already_subscribed
+    )
     return sold_qty, sold_value, target_hit
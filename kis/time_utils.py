@@ -1,5 +1,7 @@
 import asyncio
-from datetime import datetime, timedelta, timezone
+import time
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
 
 KST = timezone(timedelta(hours=9))
 
@@ -8,6 +10,17 @@ def kst_now() -> datetime:
     return datetime.now(KST)
 
 
+def monotonic_deadline(dt: datetime) -> float:
+    """KST 시각 dt를 time.monotonic() 기준 deadline으로 변환. 루프 가드는 이 값과 비교한다."""
+    return time.monotonic() + (dt - kst_now()).total_seconds()
+
+
+@lru_cache(maxsize=8)
+def kst_at(day: date, hour: int, minute: int) -> datetime:
+    """day 날짜의 KST hour:minute. datetime은 불변이라 같은 날 반복 호출 시 캐시된 객체를 재사용."""
+    return datetime(day.year, day.month, day.day, hour, minute, tzinfo=KST)
+
+
 def next_kst_datetime(hour: int, minute: int, *, base: datetime | None = None) -> datetime:
     base = base or kst_now()
     candidate = base.replace(hour=hour, minute=minute, second=0, microsecond=0)
@@ -0,0 +1,70 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from .json_utils import dumps, loads
+
+try:
+    import fcntl
+except ImportError:  # Windows: 파일 잠금 없이 동작
+    fcntl = None
+
+
+@contextmanager
+def _locked(path: str, exclusive: bool, blocking: bool = True):
+    # 여러 프로세스가 같은 캐시 파일을 공유할 수 있도록 별도 .lock 파일로 직렬화
+    # blocking=False 이면 다른 프로세스가 잡고 있을 때 기다리지 않고 False 를 yield
+    with open(path + ".lock", "a") as lf:
+        if fcntl is not None:
+            op = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+            if not blocking:
+                op |= fcntl.LOCK_NB
+            try:
+                fcntl.flock(lf, op)
+            except BlockingIOError:
+                yield False
+                return
+        try:
+            yield True
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lf, fcntl.LOCK_UN)
+
+
+def load_token_cache(path: str) -> Optional[Dict[str, Any]]:
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with _locked(path, exclusive=False):
+            with open(path, "rb") as f:
+                data = loads(f.read())
+    except (OSError, ValueError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def save_token_cache(path: str, data: Dict[str, Any]) -> bool:
+    """
+    이벤트 루프에서 (토큰 락을 잡은 채) 호출되므로 파일 락은 기다리지 않는다.
+    다른 프로세스가 쓰는 중이면 이번 저장은 건너뛰고 False 반환 (캐시일 뿐이라 다음 발급 때 다시 저장).
+    """
+    if not path:
+        return False
+    d = os.path.dirname(path) or "."
+    with _locked(path, exclusive=True, blocking=False) as ok:
+        if not ok:
+            return False
+        # 임시 파일(0600)에 쓴 뒤 os.replace 로 원자적 교체
+        fd, tmp = tempfile.mkstemp(dir=d, prefix=".kis_token.")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(dumps(data))
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+    return True
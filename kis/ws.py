@@ -1,25 +1,47 @@
 import asyncio
-import base64
-import json
 import logging
+import time
 from dataclasses import dataclass
-from typing import Dict, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import websockets
-from Crypto.Cipher import AES
-from Crypto.Util.Padding import unpad
+
+try:
+    # websockets C 확장(프레임 mask/unmask). 소스 빌드 등으로 빠져 있으면 순수 파이썬 경로로 동작
+    from websockets import speedups as _ws_speedups  # noqa: F401
+    _WS_SPEEDUPS = True
+except ImportError:
+    _WS_SPEEDUPS = False
+
+try:
+    # libbase64 SIMD 디코더
+    from pybase64 import b64decode as _b64decode
+except ImportError:
+    from base64 import b64decode as _b64decode
+
+try:
+    # OpenSSL(AES-NI) 기반 AES-CBC
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:  # cryptography 미설치 시 pycryptodome 사용
+    Cipher = None
+    from Crypto.Cipher import AES
 
 from .config import Config
+from .json_utils import dumps, loads
 from .rest import KISRest
-from .time_utils import kst_now
+from .time_utils import monotonic_deadline
+
+
+def _unpad16(plain: bytes) -> bytes:
+    # PKCS7 (block=16). KIS 서버가 만든 평문이라 패딩 바이트 전체 검증은 생략하고 길이 바이트만 확인
+    pad = plain[-1]
+    if not 0 < pad <= 16:
+        raise ValueError(f"bad PKCS7 padding: {pad}")
+    return plain[:-pad]
 
 
-def aes_cbc_base64_decrypt(cipher_b64: str, key: str, iv: str) -> str:
-    cipher_bytes = base64.b64decode(cipher_b64)
-    aes = AES.new(key.encode("utf-8"), AES.MODE_CBC, iv.encode("utf-8"))
-    plain = aes.decrypt(cipher_bytes)
-    plain = unpad(plain, 16)
-    return plain.decode("utf-8")
+# 주문번호별 체결 큐 상한 (아무도 기다리지 않는 주문의 체결이 무한히 쌓이지 않도록)
+_FILL_QUEUE_MAX = 256
 
 
 def _is_truthy(v: str) -> bool:
@@ -27,20 +49,23 @@ def _is_truthy(v: str) -> bool:
     return v in ("Y", "1", "T", "TRUE")
 
 
-def _safe_int(v: str, default: int = 0) -> int:
+def _safe_int(v: str | bytes, default: int = 0) -> int:
+    s = (v or "").strip()
     try:
-        return int(float((v or "").strip()))
+        # 수량/단가는 대부분 부호 없는 숫자열 -> float 변환 없이 바로 int
+        if s.isdigit() or (s[:1] in ("+", "-", b"+", b"-") and s[1:].isdigit()):
+            return int(s)
+        return int(float(s))
     except Exception:
         return default
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class ExecFill:
     order_no: str
     pdno: str
     qty: int
     price: int
-    raw_fields: list
 
 
 class KISWebSocket:
@@ -51,24 +76,45 @@ class KISWebSocket:
 
         self.ws: Optional[websockets.WebSocketClientProtocol] = None
 
-        self._aes_key: Dict[str, str] = {}
-        self._aes_iv: Dict[str, str] = {}
+        # tr_id -> (key, iv) bytes. encrypt=Y ack 수신 시 1회만 인코딩
+        self._aes_ctx: Dict[str, Tuple[bytes, bytes]] = {}
+        # tr_id -> 미리 만들어 둔 Cipher(AES(key), CBC(iv)) (cryptography 사용 시). iv가 tr_id별 고정이라
+        # 메시지마다 .decryptor()만 새로 만든다 (키 스케줄 확장은 decryptor 생성 시 OpenSSL이 수행)
+        self._aes_cipher: Dict[str, Any] = {}
 
         self._orderbook: Dict[str, Tuple[int, int, int, int]] = {}
         self._orderbook_seq: Dict[str, int] = {}
-        self._orderbook_event: Dict[str, asyncio.Event] = {}
+        # code -> 다음 호가를 기다리는 future 목록. 수신 시 (seq, ask1, askq1, bid1, bidq1)로 한 번에 resolve
+        self._orderbook_waiters: Dict[str, List[asyncio.Future]] = {}
 
         self._trade_price: Dict[str, int] = {}
         self._trade_seq: Dict[str, int] = {}
-        self._trade_event: Dict[str, asyncio.Event] = {}
+        # code -> 다음 체결가를 기다리는 future 목록. 수신 시 체결가로 resolve
+        self._trade_waiters: Dict[str, List[asyncio.Future]] = {}
 
         self._fills_by_order: Dict[str, asyncio.Queue] = {}
         self._recv_task: Optional[asyncio.Task] = None
 
+        # tr_id -> 실시간 데이터 핸들러 (data_type, data)
+        self._handlers: Dict[str, Callable[[str, str], None]] = {
+            "H0STASP0": self._handle_asp,
+            "H0STCNT0": self._handle_cnt,
+            cfg.exec_tr_id: self._handle_exec,
+        }
+
     async def connect(self):
         approval_key = await self.rest.get_approval_key()
-        self.ws = await websockets.connect(self.cfg.ws_url, ping_interval=20, ping_timeout=20)
-        self.log.info("WS connected: %s", self.cfg.ws_url)
+        # 짧은 텍스트/암호문 프레임이라 permessage-deflate 이득이 없음 -> 압축 해제 단계 제거
+        # (확장을 제안하지 않는 클라이언트는 압축 미지원으로 거절될 수 없으므로 deflate 재시도는 두지 않음)
+        self.ws = await websockets.connect(
+            self.cfg.ws_url,
+            compression=None,
+            ping_interval=20,
+            ping_timeout=20,
+            max_size=2 ** 20,  # KIS 프레임은 수 KB 이하
+            max_queue=256,
+        )
+        self.log.info("WS connected: %s (speedups=%s)", self.cfg.ws_url, _WS_SPEEDUPS)
 
         await self.subscribe(self.cfg.exec_tr_id, self.cfg.hts_id, approval_key=approval_key)
         self._recv_task = asyncio.create_task(self._recv_loop())
@@ -90,7 +136,7 @@ class KISWebSocket:
             },
             "body": {"tr_id": tr_id, "tr_key": tr_key},
         }
-        await self.ws.send(json.dumps(msg))
+        await self.ws.send(dumps(msg).decode("utf-8"))
         self.log.info("WS subscribe: %s %s", tr_id, tr_key)
 
     async def unsubscribe(self, tr_id: str, tr_key: str, *, approval_key: str):
@@ -104,54 +150,80 @@ class KISWebSocket:
             },
             "body": {"tr_id": tr_id, "tr_key": tr_key},
         }
-        await self.ws.send(json.dumps(msg))
+        await self.ws.send(dumps(msg).decode("utf-8"))
         self.log.info("WS unsubscribe: %s %s", tr_id, tr_key)
 
-    def _ensure_event(self, d: Dict[str, asyncio.Event], key: str) -> asyncio.Event:
-        if key not in d:
-            d[key] = asyncio.Event()
-        return d[key]
+    def _decrypt(self, ct_b64: str, tr_id: str) -> bytes:
+        cipher_bytes = _b64decode(ct_b64, validate=False)
+        cipher = self._aes_cipher.get(tr_id)
+        if cipher is not None:
+            dec = cipher.decryptor()
+            plain = _unpad16(dec.update(cipher_bytes) + dec.finalize())
+        else:
+            key_b, iv_b = self._aes_ctx[tr_id]
+            plain = _unpad16(AES.new(key_b, AES.MODE_CBC, iv_b).decrypt(cipher_bytes))
+        return plain
+
+    @staticmethod
+    async def _wait_next(d: Dict[str, List[asyncio.Future]], key: str, timeout: float):
+        fut = asyncio.get_running_loop().create_future()
+        waiters = d.setdefault(key, [])
+        waiters.append(fut)
+        try:
+            return await asyncio.wait_for(fut, timeout=timeout)
+        finally:
+            # 타임아웃/취소 시 목록에서 제거 (resolve 됐으면 producer가 이미 목록을 비움)
+            try:
+                waiters.remove(fut)
+            except ValueError:
+                pass
+
+    @staticmethod
+    def _wake(d: Dict[str, List[asyncio.Future]], key: str, result) -> None:
+        waiters = d.pop(key, None)
+        if waiters:
+            for fut in waiters:
+                if not fut.done():
+                    fut.set_result(result)
 
     def _bump_seq(self, d: Dict[str, int], key: str) -> int:
         d[key] = d.get(key, 0) + 1
         return d[key]
 
     async def wait_next_orderbook(self, code: str, last_seq: int, timeout: float = 5.0):
-        evt = self._ensure_event(self._orderbook_event, code)
-        end = asyncio.get_event_loop().time() + timeout
-        while asyncio.get_event_loop().time() < end:
-            cur = self._orderbook_seq.get(code, 0)
-            if cur > last_seq and code in self._orderbook:
-                ask1, askq1, bid1, bidq1 = self._orderbook[code]
-                return cur, ask1, askq1, bid1, bidq1
-            evt.clear()
-            try:
-                await asyncio.wait_for(evt.wait(), timeout=end - asyncio.get_event_loop().time())
-            except asyncio.TimeoutError:
-                break
-        raise asyncio.TimeoutError("orderbook timeout")
+        cur = self._orderbook_seq.get(code, 0)
+        if cur > last_seq and code in self._orderbook:
+            ask1, askq1, bid1, bidq1 = self._orderbook[code]
+            return cur, ask1, askq1, bid1, bidq1
+        try:
+            return await self._wait_next(self._orderbook_waiters, code, timeout)
+        except asyncio.TimeoutError:
+            raise asyncio.TimeoutError("orderbook timeout") from None
 
     async def wait_trade_reach(self, code: str, target_price: int, *, session_end, poll_max_wait: float = 3.0) -> int:
-        evt = self._ensure_event(self._trade_event, code)
-        while kst_now() < session_end:
+        session_end_mono = monotonic_deadline(session_end)
+        while True:
             price = self._trade_price.get(code)
             if price is not None and price >= target_price:
                 return price
-            evt.clear()
+            remain = session_end_mono - time.monotonic()
+            if remain <= 0:
+                break
             try:
-                remain = (session_end - kst_now()).total_seconds()
-                if remain <= 0:
-                    break
-                await asyncio.wait_for(evt.wait(), timeout=min(poll_max_wait, remain))
+                await self._wait_next(self._trade_waiters, code, min(poll_max_wait, remain))
             except asyncio.TimeoutError:
                 continue
         raise asyncio.TimeoutError("trade reach timeout (session ended)")
 
     def _get_order_queue(self, order_no: str) -> asyncio.Queue:
         if order_no not in self._fills_by_order:
-            self._fills_by_order[order_no] = asyncio.Queue()
+            self._fills_by_order[order_no] = asyncio.Queue(maxsize=_FILL_QUEUE_MAX)
         return self._fills_by_order[order_no]
 
+    def clear_order_queues(self):
+        """끝난 매매 사이클의 주문별 체결 큐 정리 (이후 그 주문번호를 다시 기다리지 않음)."""
+        self._fills_by_order.clear()
+
     async def wait_order_fills(self, order_no: str, *, total_timeout: float = 3.0, idle_timeout: float = 0.5):
         q = self._get_order_queue(order_no)
         filled_qty = 0
@@ -166,8 +238,16 @@ class KISWebSocket:
         filled_value += first.qty * first.price
 
         while True:
+            # 이미 도착해 있는 체결은 await 없이 한 번에 소진
+            while True:
+                try:
+                    nxt: ExecFill = q.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                filled_qty += nxt.qty
+                filled_value += nxt.qty * nxt.price
             try:
-                nxt: ExecFill = await asyncio.wait_for(q.get(), timeout=idle_timeout)
+                nxt = await asyncio.wait_for(q.get(), timeout=idle_timeout)
                 filled_qty += nxt.qty
                 filled_value += nxt.qty * nxt.price
             except asyncio.TimeoutError:
@@ -175,15 +255,106 @@ class KISWebSocket:
 
         return filled_qty, filled_value
 
+    def _handle_asp(self, data_type: str, data: str):
+        # 호가: 0|H0STASP0|005930|...
+        try:
+            # 필요한 마지막 필드(33)까지만 split -> 나머지 호가 단계는 통째로 남김
+            vals = data.split("^", 34)
+            code = vals[0]
+            ask1 = int(vals[3])
+            bid1 = int(vals[13])
+            askq1 = int(vals[23])
+            bidq1 = int(vals[33])
+            self._orderbook[code] = (ask1, askq1, bid1, bidq1)
+            seq = self._bump_seq(self._orderbook_seq, code)
+            self._wake(self._orderbook_waiters, code, (seq, ask1, askq1, bid1, bidq1))
+        except Exception as e:
+            self.log.warning("체결가 오류: %r", e)
+
+    def _handle_cnt(self, data_type: str, data: str):
+        # 체결가: 0|H0STCNT0|...|code^time^price^...
+        try:
+            vals = data.split("^", 3)
+            code = vals[0]
+            price = int(vals[2])
+            self._trade_price[code] = price
+            self._bump_seq(self._trade_seq, code)
+            self._wake(self._trade_waiters, code, price)
+        except Exception as e:
+            self.log.warning("체결가 오류: %r", e)
+
+    def _handle_exec(self, data_type: str, data: str):
+        # 체결통보: 1|H0STCNI0/H0STCNI9|...|<b64>
+        tr_id = self.cfg.exec_tr_id
+        if data_type != "1" or tr_id not in self._aes_ctx:
+            return
+
+        try:
+            # 복호화는 루프에서 바로 수행 (수 µs 수준이라 스레드 왕복 비용이 더 큼)
+            # 평문은 bytes 그대로 split 하고, 사용하는 필드만 decode
+            plain = self._decrypt(data, tr_id)
+            fields = plain.split(b"^")
+            n = len(fields)
+
+            # 기본 필드(네가 준 순서 기준)
+            # 2: 주문번호, 8: 종목코드, 9: 체결수량, 10: 체결단가
+            # 12: 거부여부, 13: 체결여부, 14: 접수여부
+            order_no = fields[2].decode("ascii", "replace") if n > 2 else ""
+            pdno = fields[8].decode("ascii", "replace") if n > 8 else ""
+
+            qty = _safe_int(fields[9] if n > 9 else b"0", 0)
+            price = _safe_int(fields[10] if n > 10 else b"0", 0)
+
+            reject_flag = fields[12].decode("ascii", "replace") if n > 12 else ""
+            exec_flag = fields[13].decode("ascii", "replace") if n > 13 else ""
+            accept_flag = fields[14].decode("ascii", "replace") if n > 14 else ""
+
+            is_reject = _is_truthy(reject_flag)
+
+            # ✅ 실체결로 인정하는 기준:
+            # - 거부가 아니고
+            # - 체결수량/체결단가가 양수
+            is_fill = (not is_reject) and (qty > 0) and (price > 0)
+
+            if is_fill:
+                fill = ExecFill(order_no=order_no, pdno=pdno, qty=qty, price=price)
+                q = self._get_order_queue(order_no)
+                try:
+                    q.put_nowait(fill)
+                except asyncio.QueueFull:
+                    self.log.warning(
+                        "EXEC_FILL dropped (queue full) order=%s code=%s qty=%s price=%s",
+                        order_no, pdno, qty, price
+                    )
+                else:
+                    self.log.info(
+                        "EXEC_FILL order=%s code=%s qty=%s price=%s (rej=%s exec=%s acc=%s)",
+                        order_no, pdno, qty, price, reject_flag, exec_flag, accept_flag
+                    )
+            else:
+                # ✅ 실체결이 아닌 이벤트(거부/접수/주문상태 등): 로그만 남김
+                self.log.info(
+                    "EXEC_NONFILL order=%s code=%s qty=%s price=%s (rej=%s exec=%s acc=%s)",
+                    order_no, pdno, qty, price, reject_flag, exec_flag, accept_flag
+                )
+
+        except Exception as e:
+            self.log.warning("EXEC_NOTIFY parse/decrypt failed: %r", e)
+
     async def _recv_loop(self):
         assert self.ws is not None
+        # 매 프레임 속성 조회를 피하려고 루프 밖에서 로컬로 바인딩
+        recv = self.ws.recv
+        get_handler = self._handlers.get
         while True:
-            msg = await self.ws.recv()
+            msg = await recv()
+            # 첫 글자로 분기: '{' = JSON(ack/PINGPONG), '0'/'1' = 실시간 데이터. bytes 프레임은 어느 쪽에도 안 걸림
+            first = msg[:1]
 
             # subscribe ack + encrypt key/iv
-            if isinstance(msg, str) and msg.startswith("{"):
+            if first == "{":
                 try:
-                    j = json.loads(msg)
+                    j = loads(msg)
                     h = j.get("header") or {}
                     tr_id = h.get("tr_id")
                     encrypt = h.get("encrypt")
@@ -192,96 +363,24 @@ class KISWebSocket:
                         iv = out.get("iv")
                         key = out.get("key")
                         if tr_id and iv and key:
-                            self._aes_iv[tr_id] = iv
-                            self._aes_key[tr_id] = key
+                            key_b, iv_b = key.encode("utf-8"), iv.encode("utf-8")
+                            self._aes_ctx[tr_id] = (key_b, iv_b)
+                            if Cipher is not None:
+                                self._aes_cipher[tr_id] = Cipher(algorithms.AES(key_b), modes.CBC(iv_b))
                             self.log.info("WS encrypt set: %s", tr_id)
                 except Exception:
                     pass
                 continue
 
-            if not isinstance(msg, str) or "|" not in msg:
+            # 실시간 데이터는 항상 "0|" 또는 "1|" 로 시작 -> 그 외는 split 전에 버림
+            if first not in ("0", "1") or msg[1:2] != "|":
                 continue
 
             parts = msg.split("|", 3)
             if len(parts) < 4:
                 continue
-            data_type, tr_id, third, data = parts[0], parts[1], parts[2], parts[3]
+            data_type, tr_id, _, data = parts
 
-            # 호가: 0|H0STASP0|005930|...
-            if tr_id == "H0STASP0":
-                vals = data.split("^")
-                try:
-                    code = vals[0]
-                    ask1 = int(vals[3])
-                    bid1 = int(vals[13])
-                    askq1 = int(vals[23])
-                    bidq1 = int(vals[33])
-                    self._orderbook[code] = (ask1, askq1, bid1, bidq1)
-                    self._bump_seq(self._orderbook_seq, code)
-                    self._ensure_event(self._orderbook_event, code).set()
-                except Exception as e:
-                    self.log.warning("체결가 오류: %r", e)
-                continue
-
-            # 체결가: 0|H0STCNT0|...|code^time^price^...
-            if tr_id == "H0STCNT0":
-                vals = data.split("^")
-                try:
-                    code = vals[0]
-                    price = int(vals[2])
-                    self._trade_price[code] = price
-                    self._bump_seq(self._trade_seq, code)
-                    self._ensure_event(self._trade_event, code).set()
-                except Exception as e:
-                    self.log.warning("체결가 오류: %r", e)
-                continue
-
-            # 체결통보: 1|H0STCNI0/H0STCNI9|...|<b64>
-            if tr_id == self.cfg.exec_tr_id and data_type == "1":
-                key = self._aes_key.get(tr_id)
-                iv = self._aes_iv.get(tr_id)
-                if not key or not iv:
-                    continue
-
-                try:
-                    plain = aes_cbc_base64_decrypt(data, key, iv)
-                    fields = plain.split("^")
-
-                    # 기본 필드(네가 준 순서 기준)
-                    # 2: 주문번호, 8: 종목코드, 9: 체결수량, 10: 체결단가
-                    # 12: 거부여부, 13: 체결여부, 14: 접수여부
-                    order_no = fields[2] if len(fields) > 2 else ""
-                    pdno = fields[8] if len(fields) > 8 else ""
-
-                    qty = _safe_int(fields[9] if len(fields) > 9 else "0", 0)
-                    price = _safe_int(fields[10] if len(fields) > 10 else "0", 0)
-
-                    reject_flag = fields[12] if len(fields) > 12 else ""
-                    exec_flag = fields[13] if len(fields) > 13 else ""
-                    accept_flag = fields[14] if len(fields) > 14 else ""
-
-                    is_reject = _is_truthy(reject_flag)
-
-                    # ✅ 실체결로 인정하는 기준:
-                    # - 거부가 아니고
-                    # - 체결수량/체결단가가 양수
-                    is_fill = (not is_reject) and (qty > 0) and (price > 0)
-
-                    if is_fill:
-                        fill = ExecFill(order_no=order_no, pdno=pdno, qty=qty, price=price, raw_fields=fields)
-                        q = self._get_order_queue(order_no)
-                        q.put_nowait(fill)
-                        self.log.info(
-                            "EXEC_FILL order=%s code=%s qty=%s price=%s (rej=%s exec=%s acc=%s)",
-                            order_no, pdno, qty, price, reject_flag, exec_flag, accept_flag
-                        )
-                    else:
-                        # ✅ 실체결이 아닌 이벤트(거부/접수/주문상태 등): 로그만 남김
-                        self.log.info(
-                            "EXEC_NONFILL order=%s code=%s qty=%s price=%s (rej=%s exec=%s acc=%s)",
-                            order_no, pdno, qty, price, reject_flag, exec_flag, accept_flag
-                        )
-
-                except Exception as e:
-                    self.log.warning("EXEC_NOTIFY parse/decrypt failed: %r", e)
-                continue
+            handler = get_handler(tr_id)
+            if handler is not None:
+                handler(data_type, data)
@@ -1,17 +1,18 @@
 import asyncio
 import logging
-from datetime import datetime, timedelta
+import sys
+from datetime import timedelta
 
 from kis.config import load_config
 from kis.rest import KISRest
 from kis.session import run_trading_session
-from kis.time_utils import kst_now, next_kst_datetime, sleep_until
+from kis.time_utils import kst_at, kst_now, next_kst_datetime, sleep_until
 
 
 async def daily_scheduler():
     """
     요구사항:
-    - 매일 08:30 토큰/approval_key 강제 재발급
+    - 매일 08:30 토큰/approval_key 강제 재발급 (08:30 이후 발급분이 디스크 캐시에 있으면 그대로 사용)
     - 매일 09:20 시작, 15:00 중지
     - 다음날 반복
     """
@@ -21,14 +22,14 @@ async def daily_scheduler():
     cfg = load_config()
     logger.info("ENV=%s REST=%s WS=%s", cfg.env, cfg.rest_base, cfg.ws_url)
 
-    cooldowns: dict[str, datetime] = {}
+    cooldowns: dict[str, float] = {}  # code -> time.monotonic()
 
     async with KISRest(cfg) as rest:
         while True:
             now = kst_now()
 
             # 08:30 refresh (이미 08:30~09:20 사이면 즉시 refresh)
-            today_0830 = now.replace(hour=8, minute=30, second=0, microsecond=0)
+            today_0830 = kst_at(now.date(), 8, 30)
             if today_0830 <= now < today_0830 + timedelta(hours=1):
                 refresh_at = now
             else:
@@ -38,17 +39,22 @@ async def daily_scheduler():
                 logger.info("Next token refresh at %s", refresh_at.isoformat())
                 await sleep_until(refresh_at)
 
-            logger.info("Refreshing access_token + approval_key (forced)")
-            await rest.force_refresh_tokens()
+            # 재시작(크래시 루프 포함) 시 오늘 08:30 이후 발급된 토큰이 디스크 캐시에 있으면 재발급 생략
+            if rest.tokens_issued_since(kst_at(refresh_at.date(), 8, 30).timestamp()):
+                logger.info("Using cached access_token + approval_key issued after 08:30")
+            else:
+                logger.info("Refreshing access_token + approval_key (forced)")
+                await rest.force_refresh_tokens()
 
             # 09:20 start
             now = kst_now()
-            session_start = now.replace(hour=9, minute=20, second=0, microsecond=0)
+            today = now.date()
+            session_start = kst_at(today, 9, 20)
             if session_start < now:
                 session_start = now  # 이미 지났으면 즉시 시작(단 15:00 전)
 
             # 15:00 end
-            session_end = now.replace(hour=15, minute=0, second=0, microsecond=0)
+            session_end = kst_at(today, 15, 0)
             if session_end <= session_start:
                 logger.info("Market session already ended today. Skip to next day.")
                 await asyncio.sleep(1.0)
@@ -67,8 +73,22 @@ async def daily_scheduler():
             logger.info("Session ended. Waiting for next schedule cycle.")
 
 
+def _run(coro):
+    # Linux/macOS에서는 uvloop(libuv) 이벤트 루프 사용. 미설치/Windows면 기본 asyncio 루프
+    if sys.platform != "win32":
+        try:
+            import uvloop
+        except ImportError:
+            uvloop = None
+        if uvloop is not None:
+            if hasattr(uvloop, "run"):  # uvloop>=0.18: install()은 3.12부터 deprecated
+                return uvloop.run(coro)
+            uvloop.install()
+    return asyncio.run(coro)
+
+
 def main():
-    asyncio.run(daily_scheduler())
+    _run(daily_scheduler())
 
 
 if __name__ == "__main__":